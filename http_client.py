@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP client for all upstream SAHPRA and NDoH requests.
+
+A single pooled httpx.AsyncClient is created lazily and reused by every tool
+so repeat calls keep their connections alive instead of paying a fresh TCP
+and TLS handshake each time. The server closes it on shutdown.
+"""
+import httpx
+import tempfile
+
+
+# Downloads up to this size stay in memory; larger ones spill to disk.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+}
+
+_client = None
+
+
+async def get_client() -> httpx.AsyncClient:
+    """
+    Returns the shared client, creating it on first use.
+    """
+    global _client
+
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            verify=False,
+            timeout=30.0,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            headers=DEFAULT_HEADERS
+        )
+
+    return _client
+
+
+async def close_client() -> None:
+    """
+    Closes the shared client and releases its pooled connections.
+    """
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def download_to_spool(
+    client: httpx.AsyncClient,
+    url: str,
+    headers: dict | None = None
+) -> tuple[httpx.Response, tempfile.SpooledTemporaryFile | None]:
+    """
+    Streams `url` into a SpooledTemporaryFile instead of buffering the whole
+    body on the response.
+
+    :param client: The shared HTTP client.
+    :param url: The file to download.
+    :param headers: Optional extra request headers, e.g. conditional headers.
+    :return: The response and the file rewound to the start, or None in
+             place of the file when the server answers 304 Not Modified.
+    """
+    async with client.stream("GET", url, headers=headers) as response:
+        if response.status_code == 304:
+            return response, None
+
+        response.raise_for_status()
+
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        try:
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+
+    spool.seek(0)
+    return response, spool
@@ -3,26 +3,110 @@
 Utilities for retrieving the NDoH Master Health Product List (MHPL).
 
 The module discovers the latest MHPL Excel link from the NDoH tenders page,
-downloads and parses the file, and caches a cleaned CSV locally for faster
-reuse. If an update fails, it falls back to the most recent cached data.
+downloads and parses the file, and caches a cleaned Arrow IPC file locally
+that is memory-mapped on reload. If an update fails, it falls back to the
+most recent cached data.
 """
 import pandas
 import httpx
 import sys
 import os
 import re
-import io
+import json
+import itertools
 from urllib.parse import urljoin
+from python_calamine import CalamineWorkbook
+import pyarrow
+import pyarrow.feather
+from http_client import get_client, download_to_spool
 import asyncio
 
 
 CACHE_DIR = "./data"
 LINK_TRACKER = os.path.join(CACHE_DIR, "ndoh_mhpl_latest_link.txt")
-CACHE_FILE = os.path.join(CACHE_DIR, "ndoh_mhpl_cache.csv")
+CACHE_FILE = os.path.join(CACHE_DIR, "ndoh_mhpl_cache.arrow")
+VALIDATOR_TRACKER = os.path.join(CACHE_DIR, "ndoh_mhpl_validators.json")
 
 _CACHED_DF = None
 _CACHED_LINK = None
 _CACHED_DATE = None
+_load_lock = asyncio.Lock()
+
+_MHPL_RE = re.compile(r'href=["\']([^"\']*(?:Master-Health-Product-List|MHPL)[^"\']+\.xlsx)["\']', re.IGNORECASE)
+_DATE_RE = re.compile(r'([0-9]{1,2}[- _][A-Za-z]+[- _][0-9]{4})')
+
+
+def _clean_cell(value):
+    """
+    Normalises a raw calamine cell: empty cells become None and whole-number
+    floats become ints, matching what pandas.read_excel would produce.
+    """
+    if value == "":
+        return None
+
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    return value
+
+
+def _read_cache() -> pandas.DataFrame:
+    """
+    Loads the cached MHPL. The file is uncompressed Arrow IPC, so it is
+    memory-mapped and converted without a parse step. string[pyarrow]
+    columns are stored as large_string; the mapper turns them back into
+    string[pyarrow], which pandas 2 would otherwise rebuild as Python
+    strings.
+    """
+    table = pyarrow.feather.read_table(CACHE_FILE, memory_map=True)
+    arrow_string = pandas.StringDtype("pyarrow")
+    return table.to_pandas(
+        types_mapper={pyarrow.string(): arrow_string, pyarrow.large_string(): arrow_string}.get
+    )
+
+
+def _load_conditional_headers(link: str) -> dict:
+    """
+    Builds If-None-Match / If-Modified-Since headers from the validators
+    saved with the cached MHPL. Returns an empty dict if none were saved
+    for `link`.
+    """
+    try:
+        with open(VALIDATOR_TRACKER, "r") as file:
+            validators = json.load(file)
+
+    except (OSError, ValueError):
+        return {}
+
+    if validators.get("link") != link:
+        return {}
+
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    return headers
+
+
+def _find_mhpl_href(html: str) -> str | None:
+    """
+    Finds the MHPL .xlsx href with plain string scans, falling back to
+    _MHPL_RE when the literal marker is missing or not inside an href.
+    """
+    marker = html.find("Master-Health-Product-List")
+
+    if marker != -1:
+        start = max(html.rfind('"', 0, marker), html.rfind("'", 0, marker))
+        if start >= 5 and html[start - 5:start].lower() == "href=":
+            end = html.find(html[start], marker)
+            href = html[start + 1:end]
+            if end != -1 and href.lower().endswith(".xlsx"):
+                return href
+
+    match = _MHPL_RE.search(html)
+    return match.group(1) if match else None
 
 
 async def discover_latest_ndoh_prod_list_link(client: httpx.AsyncClient) -> tuple[str, str]:
@@ -38,20 +122,12 @@ async def discover_latest_ndoh_prod_list_link(client: httpx.AsyncClient) -> tupl
     response = await client.get(URL, headers=headers, follow_redirects=True)
     response.raise_for_status()
 
-    match = re.search(
-        r'href=["\']([^"\']*(?:Master-Health-Product-List|MHPL)[^"\']+\.xlsx)["\']',
-        response.text,
-        re.IGNORECASE
-    )
+    RELATIVE_PATH = _find_mhpl_href(response.text)
 
-    if match:
-        RELATIVE_PATH = match.group(1)
+    if RELATIVE_PATH:
         FULL_URL = urljoin(URL, RELATIVE_PATH)
 
-        date_match = re.search(
-            r'([0-9]{1,2}[- _][A-Za-z]+[- _][0-9]{4})',
-            RELATIVE_PATH
-        )
+        date_match = _DATE_RE.search(RELATIVE_PATH)
         doc_date = date_match.group(1).replace('-', ' ').replace('_', ' ') if date_match else "Unknown Date"
 
         return FULL_URL, doc_date
@@ -61,78 +137,143 @@ async def discover_latest_ndoh_prod_list_link(client: httpx.AsyncClient) -> tupl
     )
 
 
-async def get_latest_ndoh_prod_list_df() -> tuple[pandas.DataFrame, str, bool]:
+async def _load_ndoh_prod_list_df() -> tuple[pandas.DataFrame, str, bool]:
     """
-    Returns the NDoH Master Hesalth Product List.
-    Downloads only if a newer link is found.
+    Loads the MHPL from RAM, disk or the NDoH site. Callers go through
+    get_latest_ndoh_prod_list_df, which serialises loads.
     """
     global _CACHED_DF, _CACHED_LINK, _CACHED_DATE
 
-    async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-        try:
-            current_link, doc_date = await discover_latest_ndoh_prod_list_link(client)
-
+    client = await get_client()
+
+    try:
+        current_link, doc_date = await discover_latest_ndoh_prod_list_link(client)
+
+        in_ram = _CACHED_LINK == current_link and _CACHED_DF is not None
+        on_disk = False
+        if not in_ram and os.path.exists(LINK_TRACKER) and os.path.exists(CACHE_FILE):
+            with open(LINK_TRACKER, "r") as file:
+                on_disk = file.read().strip() == current_link
+
+        # Same link as the cache: ask the server whether the file changed
+        response, spool = None, None
+        if in_ram or on_disk:
+            conditional_headers = _load_conditional_headers(current_link)
+            if conditional_headers:
+                # The link still matches, so a failed check keeps the cache live.
+                try:
+                    response, spool = await download_to_spool(client, current_link, conditional_headers)
+                except httpx.HTTPError as e:
+                    print(f"WARNING: MHPL revalidation failed, serving cache: {str(e)}", file=sys.stderr)
+                    response, spool = None, None
+
+        if (in_ram or on_disk) and spool is None:
             # RAM Cache Hit
-            if _CACHED_LINK == current_link and _CACHED_DF is not None:
+            if in_ram:
                 print(f"DEBUG: MHPL cache hit in RAM ({doc_date}).", file=sys.stderr)
                 return _CACHED_DF, doc_date, True
 
-            # Disk Cache Hit            
-            if os.path.exists(LINK_TRACKER) and os.path.exists(CACHE_FILE):
-                with open(LINK_TRACKER, "r") as file:
-                    if file.read().strip() == current_link:
-                        print(f"DEBUG: MHPL RAM empty, but Disk cache is up to date ({doc_date}). Loading...", file=sys.stderr)
-                        _CACHED_DF = pandas.read_csv(CACHE_FILE)
-                        _CACHED_LINK = current_link
-                        _CACHED_DATE = doc_date
-                        return _CACHED_DF, doc_date, True
-
-            # Downlaod & Parse (New link found)
-            print(f"DEBUG: Downloading new MHPL: {current_link}", file=sys.stderr)
-            response = await client.get(current_link)
-            response.raise_for_status()
-
-            print(f"DEBUG: Parsing Excel file...", file=sys.stderr)
-            raw_df = pandas.read_excel(io.BytesIO(response.content), header=3)
-
-            target_columns = [0, 2, 3, 9, 11, 13, 14, 15, 17, 19, 20, 29, 31]
-            df = raw_df.iloc[:, target_columns].copy()
+            # Disk Cache Hit
+            print(f"DEBUG: MHPL RAM empty, but Disk cache is up to date ({doc_date}). Loading...", file=sys.stderr)
+            _CACHED_DF = _read_cache()
+            _CACHED_LINK = current_link
+            _CACHED_DATE = doc_date
+            return _CACHED_DF, doc_date, True
 
-            df.columns = [
-                "Contract", "NSN", "Description", "INN", "Supplier",
-                "Unit_Price", "Lead_Time_Days", "EML_Status", "ATC_Code",
-                "Care_Level", "Quantity_Awarded", "MOQ", "Contract_Expiry"
-            ]
+        # Downlaod & Parse (New link found, or same link with new content)
+        if spool is None:
+            print(f"DEBUG: Downloading new MHPL: {current_link}", file=sys.stderr)
+            response, spool = await download_to_spool(client, current_link)
+        else:
+            print(f"DEBUG: MHPL changed on the server, reloading: {current_link}", file=sys.stderr)
+
+        print(f"DEBUG: Parsing Excel file...", file=sys.stderr)
+        with spool:
+            workbook = CalamineWorkbook.from_filelike(spool)
+        sheet = workbook.get_sheet_by_index(0)
+
+        target_columns = [0, 2, 3, 9, 11, 13, 14, 15, 17, 19, 20, 29, 31]
+        column_names = [
+            "Contract", "NSN", "Description", "INN", "Supplier",
+            "Unit_Price", "Lead_Time_Days", "EML_Status", "ATC_Code",
+            "Care_Level", "Quantity_Awarded", "MOQ", "Contract_Expiry"
+        ]
+        column_values = [[] for _ in target_columns]
+
+        # Rows 0-3 hold the title block and header; products start on row 4.
+        for row in itertools.islice(sheet.iter_rows(), 4, None):
+            if row[3] == "":
+                continue
+
+            for values, index in zip(column_values, target_columns):
+                values.append(_clean_cell(row[index]))
+
+        workbook.close()
+
+        df = pandas.DataFrame(dict(zip(column_names, column_values)))
+        del column_values
+
+        # Give every column a single type so the frame can be stored as Arrow.
+        # Only the columns analyse_ndoh_market already coerces are made
+        # numeric; the other mixed columns keep their values as text.
+        numeric_columns = ["Unit_Price", "Quantity_Awarded"]
+        text_columns = [
+            "Contract", "NSN", "Description", "INN", "Supplier",
+            "Lead_Time_Days", "EML_Status", "ATC_Code", "Care_Level", "MOQ"
+        ]
+        df[numeric_columns] = df[numeric_columns].apply(pandas.to_numeric, errors="coerce")
+        df[text_columns] = df[text_columns].astype("string[pyarrow]")
+        df["Contract_Expiry"] = pandas.to_datetime(df["Contract_Expiry"], errors="coerce")
+
+        # Update RAM state
+        _CACHED_DF, _CACHED_LINK, _CACHED_DATE = df, current_link, doc_date
+
+        # Persistence Logic
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # Write beside the cache and swap it in, so frames still mapped
+            # from the old file keep a valid inode.
+            pyarrow.feather.write_feather(df, CACHE_FILE + ".tmp", compression="uncompressed")
+            os.replace(CACHE_FILE + ".tmp", CACHE_FILE)
+            with open(LINK_TRACKER, "w") as file:
+                file.write(current_link)
+            with open(VALIDATOR_TRACKER, "w") as file:
+                json.dump({
+                    "link": current_link,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified")
+                }, file)
+            print(f"DEBUG: MHPL cache rebuilt and saved to disk.", file=sys.stderr)
 
-            df.dropna(subset=["Description"], inplace=True)
+        except OSError as e:
+            print(f"WARNING: Skipping disk persistence (Read-Only FS): {e}", file=sys.stderr)
 
-            # Update RAM state
-            _CACHED_DF, _CACHED_LINK, _CACHED_DATE = df, current_link, doc_date
+        return df, doc_date, True
 
-            # Persistence Logic
-            try:
-                os.makedirs(CACHE_DIR, exist_ok=True)
-                df.to_csv(CACHE_FILE, index=False)
-                with open(LINK_TRACKER, "w") as file:
-                    file.write(current_link)
-                print(f"DEBUG: MHPL cache rebuilt and saved to disk.", file=sys.stderr)
+    except Exception as e:
+        if _CACHED_DF is not None:
+            print(f"ERROR: Update failed, falling back to RAM cache: {str(e)}", file=sys.stderr)
+            return _CACHED_DF, _CACHED_DATE or "Unknown", False
 
-            except OSError as e:
-                print(f"WARNING: Skipping disk persistence (Read-Only FS): {e}", file=sys.stderr)
+        elif os.path.exists(CACHE_FILE):
+            print(f"ERROR: Update failed, falling back to stale cache: {str(e)}", file=sys.stderr)
+            df = _read_cache()
+            return df, "Previous release (Stale)", False
 
-            return df, doc_date, True
+        raise e
 
-        except Exception as e:
-            if _CACHED_DF is not None:
-                print(f"ERROR: Update failed, falling back to RAM cache: {str(e)}", file=sys.stderr)
-                return _CACHED_DF, _CACHED_DATE or "Unknown", False
 
-            elif os.path.exists(CACHE_FILE):
-                print(f"ERROR: Update failed, falling back to stale cache: {str(e)}", file=sys.stderr)
-                df = pandas.read_csv(CACHE_FILE)
-                return df, "Previous release (Stale)", False
 
-            raise e
+async def get_latest_ndoh_prod_list_df() -> tuple[pandas.DataFrame, str, bool]:
+    """
+    Returns the NDoH Master Hesalth Product List.
+    Downloads only if a newer link is found, or if the server reports that
+    the file behind the current link has changed.
+    """
+    # Single-flight load: a caller that arrives while another is
+    # downloading waits for it and then finds the fresh frame in RAM.
+    async with _load_lock:
+        return await _load_ndoh_prod_list_df()
 
 
 if __name__ == "__main__":
@@ -155,7 +296,7 @@ if __name__ == "__main__":
             mock_query = "Aspirin"
 
             print(f"\n--- MOCK SEARCH: '{mock_query}' ---")
-            results = df[df['Description'].str.contains(mock_query, case=False, na=False)]
+            results = df[df['Description'].str.contains(mock_query, case=False, regex=False, na=False)]
             if not results.empty:
                 print(results.head(3).to_markdown(index=False))
             else:
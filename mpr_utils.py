@@ -3,26 +3,75 @@
 Utilities for retrieving the Database of Medicine Prices (MPR/SEP).
 
 The module dicovers the latest Database of Medicine Prices Excel link from the
-NDoH NHI page, downloads and parses the file, and caches a cleaned CSV locally.
+NDoH NHI page, downloads and parses the file, and caches a cleaned,
+gzip-compressed CSV locally.
 If an update fails, it falls back to the most recent cached data.
 """
 import pandas
+import pyarrow
+import pyarrow.csv
 import httpx
 import sys
 import os
 import re
-import io
 from urllib.parse import urljoin
+from http_client import get_client, download_to_spool
 import asyncio
 
 
 CACHE_DIR = "./data"
 LINK_TRACKER = os.path.join(CACHE_DIR, "ndoh_mpr_latest_link.txt")
-CACHE_FILE = os.path.join(CACHE_DIR, "ndoh_mpr_sep_cache.csv")
+CACHE_FILE = os.path.join(CACHE_DIR, "ndoh_mpr_sep_cache.csv.gz")
 
 _CACHED_DF = None
 _CACHED_LINK = None
 _CACHED_DATE = None
+_load_lock = asyncio.Lock()
+
+# Column types of the cleaned frame, so the CSV cache reloads without
+# inference and NAPPI codes keep their leading zeros.
+# Only the prices analyse_private_market coerces are numeric; the other
+# mixed columns keep their values as text.
+_MPR_MIXED_COLUMNS = ["Pack_Size", "Quantity", "Logistics_Fee"]
+_MPR_TEXT_COLUMNS = [
+    "Applicant", "Proprietery_Name", "Active_Ingredient",
+    "Dosage_Form", "NAPPI_Code", "Effective_Date",
+    *_MPR_MIXED_COLUMNS
+]
+_MPR_NUMERIC_COLUMNS = ["Manufacturer_Price", "SEP"]
+_MPR_COLUMN_TYPES = {
+    **{column: pyarrow.string() for column in _MPR_TEXT_COLUMNS},
+    **{column: pyarrow.float64() for column in _MPR_NUMERIC_COLUMNS}
+}
+
+_MPR_RE = re.compile(r'href=["\']([^"\']*(?:database|prices)[^"\']+\.xlsx)["\']', re.IGNORECASE)
+_DATE_RE = re.compile(r'([0-9]{1,2}[- _][A-Za-z]+[- _][0-9]{4})')
+
+
+def _clean_cell(value):
+    """
+    Drops the ".0" Excel puts on whole numbers, so a mixed column such as
+    Pack_Size reads "30" rather than "30.0" once stored as text.
+    """
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    return value
+
+
+def _read_cache() -> pandas.DataFrame:
+    """
+    Loads the cached MPR with pyarrow's CSV reader. Column types are fixed
+    up front, so nothing is inferred and NAPPI codes keep their leading zeros.
+    """
+    table = pyarrow.csv.read_csv(
+        CACHE_FILE,
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types=_MPR_COLUMN_TYPES,
+            strings_can_be_null=True
+        )
+    )
+    return table.to_pandas(types_mapper={pyarrow.string(): pandas.StringDtype("pyarrow")}.get)
 
 
 async def discover_latest_mpr_list_link(client: httpx.AsyncClient) -> tuple[str, str]:
@@ -39,20 +88,13 @@ async def discover_latest_mpr_list_link(client: httpx.AsyncClient) -> tuple[str,
     response = await client.get(URL, headers=headers, follow_redirects=True)
     response.raise_for_status()
 
-    match = re.search(
-        r'href=["\']([^"\']*(?:database|prices)[^"\']+\.xlsx)["\']',
-        response.text,
-        re.IGNORECASE
-    )
+    match = _MPR_RE.search(response.text)
 
     if match:
         RELATIVE_PATH = match.group(1)
         FULL_URL = urljoin(URL, RELATIVE_PATH)
 
-        date_match = re.search(
-            r'([0-9]{1,2}[- _][A-Za-z]+[- _][0-9]{4})',
-            RELATIVE_PATH
-        )
+        date_match = _DATE_RE.search(RELATIVE_PATH)
         doc_date = date_match.group(1).replace('-', ' ').replace('_', ' ') if date_match else "Unknown Date"
 
         return FULL_URL, doc_date
@@ -62,87 +104,116 @@ async def discover_latest_mpr_list_link(client: httpx.AsyncClient) -> tuple[str,
     )
 
 
-async def get_latest_mpr_list_df() -> tuple[pandas.DataFrame, str, bool]:
+async def _load_mpr_list_df() -> tuple[pandas.DataFrame, str, bool]:
     """
-    Returns the Database of Medicine Prices as a Pandas DataFrame. Downloads
-    only if a newer link is found or if the cache is missing.
+    Loads the MPR from RAM, disk or the NDoH site. Callers go through
+    get_latest_mpr_list_df, which serialises loads.
     """
     global _CACHED_DF, _CACHED_LINK, _CACHED_DATE
 
-    async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
+    client = await get_client()
+
+    try:
+        current_link, doc_date = await discover_latest_mpr_list_link(client)
+
+        # RAM Cache Hit
+        if _CACHED_LINK == current_link and _CACHED_DF is not None:
+            print(f"DEBUG: MPR cache hit in RAM ({doc_date}).", file=sys.stderr)
+            return _CACHED_DF, doc_date, True
+
+        # Disk Cache Hit
+        if os.path.exists(LINK_TRACKER) and os.path.exists(CACHE_FILE):
+            with open(LINK_TRACKER, "r") as file:
+                if file.read().strip() == current_link:
+                    print(f"DEBUG: MPR RAM empty, but Disk cache is up to date ({doc_date}). Loading...", file=sys.stderr)
+                    _CACHED_DF = _read_cache()
+                    _CACHED_LINK = current_link
+                    _CACHED_DATE = doc_date
+                    return _CACHED_DF, doc_date, True
+
+        # Downlaod & Parse (New link found)
+        print(f"DEBUG: Downloading new MPR: {current_link}, {doc_date}", file=sys.stderr)
+        _, spool = await download_to_spool(client, current_link)
+
+        print(f"DEBUG: Parsing Excel file...", file=sys.stderr)
+        # usecols yields columns in sheet order, so `names` follows the sheet
+        # and the frame is then reordered to the layout used downstream.
+        with spool:
+            raw_df = pandas.read_excel(
+                spool,
+                header=1,
+                engine="calamine",
+                usecols=[1, 3, 6, 7, 10, 11, 12, 13, 14, 16, 18],
+                names=[
+                    "Applicant", "NAPPI_Code", "Proprietery_Name", "Active_Ingredient",
+                    "Dosage_Form", "Pack_Size", "Quantity",
+                    "Manufacturer_Price", "Logistics_Fee", "SEP", "Effective_Date"
+                ],
+                dtype={"NAPPI_Code": "string"}
+            )
+
+        df = raw_df.reindex(columns=[
+            "Applicant", "Proprietery_Name", "Active_Ingredient",
+            "Dosage_Form", "Pack_Size", "Quantity", "NAPPI_Code",
+            "Manufacturer_Price", "Logistics_Fee", "SEP", "Effective_Date"
+        ])
+        del raw_df
+
+        cols_to_fill = [
+            "Applicant", "Proprietery_Name",
+            "Dosage_Form", "Pack_Size",
+            "Quantity", "NAPPI_Code",
+            "Manufacturer_Price", "Logistics_Fee",
+            "SEP", "Effective_Date"
+        ]
+        df[cols_to_fill] = df[cols_to_fill].ffill()
+
+        df = df.dropna(subset=["Active_Ingredient"])
+
+        # Match the types the cache is read back with.
+        df[_MPR_NUMERIC_COLUMNS] = df[_MPR_NUMERIC_COLUMNS].apply(pandas.to_numeric, errors="coerce").astype("float64")
+        df[_MPR_MIXED_COLUMNS] = df[_MPR_MIXED_COLUMNS].map(_clean_cell)
+        df[_MPR_TEXT_COLUMNS] = df[_MPR_TEXT_COLUMNS].astype("string[pyarrow]")
+
+        # Update RAM state
+        _CACHED_DF, _CACHED_LINK, _CACHED_DATE = df, current_link, doc_date
+
+        # Persistence Logic
         try:
-            current_link, doc_date = await discover_latest_mpr_list_link(client)
-
-            # RAM Cache Hit
-            if _CACHED_LINK == current_link and _CACHED_DF is not None:
-                print(f"DEBUG: MPR cache hit in RAM ({doc_date}).", file=sys.stderr)
-                return _CACHED_DF, doc_date, True
-
-            # Disk Cache Hit
-            if os.path.exists(LINK_TRACKER) and os.path.exists(CACHE_FILE):
-                with open(LINK_TRACKER, "r") as file:
-                    if file.read().strip() == current_link:
-                        print(f"DEBUG: MPR RAM empty, but Disk cache is up to date ({doc_date}). Loading...", file=sys.stderr)
-                        _CACHED_DF = pandas.read_csv(CACHE_FILE)
-                        _CACHED_LINK = current_link
-                        _CACHED_DATE = doc_date
-                        return _CACHED_DF, doc_date, True
-
-            # Downlaod & Parse (New link found)
-            print(f"DEBUG: Downloading new MPR: {current_link}, {doc_date}", file=sys.stderr)
-            response = await client.get(current_link)
-            response.raise_for_status()
-
-            print(f"DEBUG: Parsing Excel file...", file=sys.stderr)
-            raw_df = pandas.read_excel(io.BytesIO(response.content), header=1)
-
-            target_columns = [1, 6, 7, 10, 11, 12, 3, 13, 14, 16, 18]
-            df = raw_df.iloc[:, target_columns].copy()
-
-            df.columns = [
-                "Applicant", "Proprietery_Name", "Active_Ingredient",
-                "Dosage_Form", "Pack_Size", "Quantity", "NAPPI_Code",
-                "Manufacturer_Price", "Logistics_Fee", "SEP", "Effective_Date"
-            ]
-
-            cols_to_fill = [
-                "Applicant", "Proprietery_Name",
-                "Dosage_Form", "Pack_Size",
-                "Quantity", "NAPPI_Code",
-                "Manufacturer_Price", "Logistics_Fee",
-                "SEP", "Effective_Date"
-            ]
-            df[cols_to_fill] = df[cols_to_fill].ffill()
-
-            df.dropna(subset=["Active_Ingredient"], inplace=True)
-
-            # Update RAM state
-            _CACHED_DF, _CACHED_LINK, _CACHED_DATE = df, current_link, doc_date
-
-            # Persistence Logic
-            try:
-                os.makedirs(CACHE_DIR, exist_ok=True)
-                df.to_csv(CACHE_FILE, index=False)
-                with open(LINK_TRACKER, "w") as file:
-                    file.write(current_link)
-                print(f"DEBUG: MPR cache rebuilt and saved to disk.", file=sys.stderr)
-
-            except OSError as e:
-                print(f"WARNING: Skipping disk persistence (Read-Only FS): {e}", file=sys.stderr)
-            
-            return df, doc_date, True
-        
-        except Exception as e:
-            if _CACHED_DF is not None:
-                print(f"ERROR: Update failed, falling back to RAM cache: {str(e)}", file=sys.stderr)
-                return _CACHED_DF, _CACHED_DATE or "Unknown", False
-            
-            elif os.path.exists(CACHE_FILE):
-                print(f"ERROR: Update failed, falling back to stale Disk cache: {str(e)}", file=sys.stderr)
-                df = pandas.read_csv(CACHE_FILE)
-                return df, "Previous release (Stale)", False
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            df.to_csv(CACHE_FILE, index=False, compression="gzip")
+            with open(LINK_TRACKER, "w") as file:
+                file.write(current_link)
+            print(f"DEBUG: MPR cache rebuilt and saved to disk.", file=sys.stderr)
+
+        except OSError as e:
+            print(f"WARNING: Skipping disk persistence (Read-Only FS): {e}", file=sys.stderr)
+
+        return df, doc_date, True
+
+    except Exception as e:
+        if _CACHED_DF is not None:
+            print(f"ERROR: Update failed, falling back to RAM cache: {str(e)}", file=sys.stderr)
+            return _CACHED_DF, _CACHED_DATE or "Unknown", False
+
+        elif os.path.exists(CACHE_FILE):
+            print(f"ERROR: Update failed, falling back to stale Disk cache: {str(e)}", file=sys.stderr)
+            df = _read_cache()
+            return df, "Previous release (Stale)", False
+
+        raise e
+
 
-            raise e
+
+async def get_latest_mpr_list_df() -> tuple[pandas.DataFrame, str, bool]:
+    """
+    Returns the Database of Medicine Prices as a Pandas DataFrame. Downloads
+    only if a newer link is found or if the cache is missing.
+    """
+    # Single-flight load: a caller that arrives while another is
+    # downloading waits for it and then finds the fresh frame in RAM.
+    async with _load_lock:
+        return await _load_mpr_list_df()
 
 
 if __name__ == "__main__":
@@ -158,6 +229,13 @@ if __name__ == "__main__":
             print(f"Success: Loaded {len(df)} medicines.", file=sys.stderr)
             print(f"Source Date: {doc_date} [{status}]", file=sys.stderr)
             print(f"Columns: {list(df.columns)}", file=sys.stderr)
+
+            if os.path.exists(CACHE_FILE):
+                try:
+                    pandas.testing.assert_frame_equal(df.reset_index(drop=True), _read_cache())
+                    print("Cache round-trip: reloaded frame matches.", file=sys.stderr)
+                except AssertionError as e:
+                    print(f"Cache round-trip MISMATCH: {str(e)}", file=sys.stderr)
             
             print("\n--- DATA SAMPLE (TOP 5) ---")
             try:
@@ -4,17 +4,44 @@ Utilities for interacting with SAHPRA public data endpoints.
 
 Includes a cached helper to fetch the Ninja Tables public nonce used by
 SAHPRA's approved-licences tables. The nonce is stored in-memory for
-12 hours to reduce repeated page fetches.
+12 hours to reduce repeated page fetches, and persisted to disk so a
+restarted process can reuse it.
 """
 import httpx
 import time
+import json
+import sys
+import os
 import re
 import asyncio
+from http_client import get_client
 
 
-_nonce_cache = {"value": None, "timestamp": 0}
+CACHE_DIR = "./data"
+NONCE_FILE = os.path.join(CACHE_DIR, "sahpra_nonce.json")
 CACHE_LIFETIME = 43200
 
+_NONCE_RE = re.compile(r'["\']ninja_table_public_nonce["\']\s*:\s*["\']([a-f0-9]+)["\']')
+
+
+def _load_nonce_cache() -> dict:
+    """
+    Loads the nonce persisted by a previous process, or an empty cache if
+    there is none. Expiry is still checked by get_sahpra_nonce.
+    """
+    try:
+        with open(NONCE_FILE, "r") as file:
+            cache = json.load(file)
+        return {"value": cache["value"], "timestamp": float(cache["timestamp"])}
+
+    except (OSError, ValueError, KeyError, TypeError):
+        return {"value": None, "timestamp": 0}
+
+
+_nonce_cache = _load_nonce_cache()
+_nonce_lock = asyncio.Lock()
+
+
 async def get_sahpra_nonce(client: httpx.AsyncClient) -> str:
     """
     Gets and caches Ninja Tables nonce every 12hrs.
@@ -25,28 +52,43 @@ async def get_sahpra_nonce(client: httpx.AsyncClient) -> str:
     :rtype: str
     """
     global _nonce_cache
-    now = time.time()
 
-    if _nonce_cache["value"] and (now - _nonce_cache["timestamp"] < CACHE_LIFETIME):
+    if _nonce_cache["value"] and (time.time() - _nonce_cache["timestamp"] < CACHE_LIFETIME):
         return _nonce_cache["value"]
-    
-    URL = "https://www.sahpra.org.za/approved-licences/"
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36"
-    }
+    # Single-flight refresh: concurrent callers wait for the first fetch
+    # instead of each hitting the landing page.
+    async with _nonce_lock:
+        now = time.time()
 
-    response = await client.get(URL, headers=headers, follow_redirects=True)
-    response.raise_for_status()
+        if _nonce_cache["value"] and (now - _nonce_cache["timestamp"] < CACHE_LIFETIME):
+            return _nonce_cache["value"]
 
-    match = re.search(r'["\']ninja_table_public_nonce["\']\s*:\s*["\']([a-f0-9]+)["\']', response.text)
-    if not match:
-        raise ValueError("Nonce not found.")
-    
-    _nonce_cache["value"] = match.group(1)
-    _nonce_cache["timestamp"] = now
+        URL = "https://www.sahpra.org.za/approved-licences/"
+
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36"
+        }
+
+        response = await client.get(URL, headers=headers, follow_redirects=True)
+        response.raise_for_status()
+
+        match = _NONCE_RE.search(response.text)
+        if not match:
+            raise ValueError("Nonce not found.")
+
+        _nonce_cache["value"] = match.group(1)
+        _nonce_cache["timestamp"] = now
 
-    return _nonce_cache["value"]
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(NONCE_FILE, "w") as file:
+                json.dump(_nonce_cache, file)
+
+        except OSError as e:
+            print(f"WARNING: Skipping nonce persistence (Read-Only FS): {e}", file=sys.stderr)
+
+        return _nonce_cache["value"]
 
 
 if __name__ == "__main__":
@@ -54,11 +96,12 @@ if __name__ == "__main__":
         """
         Quick manual test: fetch the SAHPRA nonce and print it to stdout.
         """
-        async with httpx.AsyncClient(verify=False) as client:
-            try:
-                nonce = await get_sahpra_nonce(client)
-                print(f"Nonce: {nonce}")
-            except Exception as e:
-                print(f"Error: {e}")
+        client = await get_client()
+
+        try:
+            nonce = await get_sahpra_nonce(client)
+            print(f"Nonce: {nonce}")
+        except Exception as e:
+            print(f"Error: {e}")
     
     asyncio.run(test_get_sahpra_nonce())
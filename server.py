@@ -19,23 +19,157 @@ from mcp.server.transport_security import TransportSecuritySettings
 from sahpra_utils import get_sahpra_nonce
 from mhpl_utils import get_latest_ndoh_prod_list_df
 from mpr_utils import get_latest_mpr_list_df
-import httpx
+from http_client import get_client, close_client
+from collections import OrderedDict
+from contextlib import asynccontextmanager, suppress
 import pandas
+import orjson
+import asyncio
+import time
 import os
 import sys
 
 
+_prefetch_task = None
+
+
+def _start_prefetch() -> None:
+    """
+    Schedules the cache prefetch on the running loop, once per process.
+    """
+    global _prefetch_task
+
+    if _prefetch_task is None:
+        _prefetch_task = asyncio.create_task(_prefetch_caches())
+
+
+@asynccontextmanager
+async def server_lifespan(server: FastMCP):
+    """
+    Starts the cache prefetch when the first session opens, for entry
+    points that import `mcp` without running `__main__`. Stateless HTTP
+    enters the lifespan on every request; the guard in _start_prefetch
+    keeps it to one task.
+    """
+    _start_prefetch()
+
+    yield
+
+
 mcp = FastMCP(
     "za-pharma-intelligence",
     stateless_http=True,
+    lifespan=server_lifespan,
     transport_security=TransportSecuritySettings(
         enable_dns_rebinding_protection=False
     )
 )
 
+RESPONSE_CACHE_LIFETIME = 600
+RESPONSE_CACHE_SIZE = 256
+
+_companies_cache = OrderedDict()
+_search_cache = OrderedDict()
+
+SEARCH_COLUMNS = ["applicantName", "productName", "api", "licence_no", "application_no", "reg_date", "status", "secureId"]
+
+
+def _build_static_search_payload() -> dict:
+    """
+    Builds the DataTables form for the SAHPRA product search. Only start,
+    length and search[value] change per call, so everything else is built
+    once at import.
+    """
+    payload = {
+        "draw": "1",
+        "start": "0",
+        "length": "0",
+        "search[value]": "",
+        "search[regex]": "false",
+        "order[0][column]": "0",
+        "order[0][dir]": "asc"
+    }
+
+    for i, column_name in enumerate(SEARCH_COLUMNS):
+        payload[f"columns[{i}][data]"] = column_name
+        payload[f"columns[{i}][name]"] = column_name if column_name != "secureId" else ""
+        payload[f"columns[{i}][searchable]"] = "true"
+        payload[f"columns[{i}][orderable]"] = "true"
+        payload[f"columns[{i}][search][value]"] = ""
+        payload[f"columns[{i}][search][regex]"] = "false"
+
+    return payload
+
+
+_STATIC_SEARCH_PAYLOAD = _build_static_search_payload()
+
+
+def _cache_get(cache: OrderedDict, key):
+    """
+    Returns the cached value for `key`, or None if it is missing or older
+    than RESPONSE_CACHE_LIFETIME.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        return None
+
+    timestamp, value = entry
+    if time.time() - timestamp >= RESPONSE_CACHE_LIFETIME:
+        del cache[key]
+        return None
+
+    cache.move_to_end(key)
+    return value
+
+
+def _cache_put(cache: OrderedDict, key, value) -> None:
+    """
+    Stores `value` under `key`, evicting the least recently used entries
+    once the cache holds more than RESPONSE_CACHE_SIZE items.
+    """
+    cache[key] = (time.time(), value)
+    cache.move_to_end(key)
+
+    while len(cache) > RESPONSE_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def _match_any_column(df: pandas.DataFrame, query: str) -> pandas.Series:
+    """
+    Returns a mask of rows where any column contains `query` (literal,
+    case-insensitive). Each column is scanned as an Arrow string array
+    instead of applying a Python function row by row.
+    """
+    mask = pandas.Series(False, index=df.index)
+    for column in df.columns:
+        mask |= df[column].astype("string[pyarrow]").str.contains(query, case=False, regex=False, na=False)
+
+    return mask
+
+
+async def _prefetch_caches() -> None:
+    """
+    Warms the MHPL, MPR and SAHPRA nonce caches in the background so the
+    first tool call does not pay the cold download. Failures are only
+    logged; the first real call then fetches as it normally would.
+    """
+    client = await get_client()
+    results = await asyncio.gather(
+        get_latest_ndoh_prod_list_df(),
+        get_latest_mpr_list_df(),
+        get_sahpra_nonce(client),
+        return_exceptions=True
+    )
+
+    for name, result in zip(("MHPL", "MPR", "SAHPRA nonce"), results):
+        if isinstance(result, BaseException):
+            print(f"WARNING: Startup prefetch of {name} failed: {result}", file=sys.stderr)
+        else:
+            print(f"DEBUG: Startup prefetch of {name} complete.", file=sys.stderr)
+
 
 @mcp.tool()
-async def get_licensed_companies(category: str = "Manufacturers & Packers", limit: int = 50, offset: int = 0) -> str:
+async def get_licensed_companies(category: str = "Manufacturers & Packers", limit: int = 50, offset: int = 0, search: str = "") -> str:
     """
     Use this to retrieve the official SAHPRA list of establishments for a specific catagory.
 
@@ -50,6 +184,8 @@ async def get_licensed_companies(category: str = "Manufacturers & Packers", limi
     :type limit: int
     :param offset: Number of records to skip for pagination.
     :type offset: int
+    :param search: Optional text to match against any field (e.g., a company name or town). Leave empty to list the whole category.
+    :type search: str
     :return: A markdown table containing the first 50 licensed establishments for the requested category.
     :rtype: str
     """
@@ -79,8 +215,11 @@ async def get_licensed_companies(category: str = "Manufacturers & Packers", limi
     if not table_id:
         return f"Error: The category `{category}` was not found."
 
-    async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-        try:
+    try:
+        df = _cache_get(_companies_cache, category)
+
+        if df is None:
+            client = await get_client()
             nonce = await get_sahpra_nonce(client)
 
             print(f"DEBUG: Using nonce {nonce} for category '{category}'", file=sys.stderr)
@@ -98,23 +237,32 @@ async def get_licensed_companies(category: str = "Manufacturers & Packers", limi
             response = await client.get(API_URL, params=params, headers=headers)
             response.raise_for_status()
 
-            raw_data = response.json()
+            raw_data = orjson.loads(response.content)
             if not raw_data:
                 return f"No records for `{category}`"
-            
+
             clean_data = [row.get("value", {}) for row in raw_data]
-            
+
             df = pandas.DataFrame(clean_data)
-            total_records = len(df)
+            _cache_put(_companies_cache, category, df)
+
+        if search:
+            df = df[_match_any_column(df, search)]
+
+            if df.empty:
+                return f"No records matching `{search}` for `{category}`"
 
-            # Slice dataframe based on pagination parameters
-            paginated_df = df.iloc[offset: offset + limit]
-            meta_info = f"**Category** {category} | **Showing** {offset + 1} - {min(offset + limit, total_records)} of {total_records}\n\n"
+        total_records = len(df)
 
-            return meta_info + paginated_df.to_markdown(index=False)
+        # Slice dataframe based on pagination parameters
+        paginated_df = df.iloc[offset: offset + limit]
+        search_info = f" | **Search** {search}" if search else ""
+        meta_info = f"**Category** {category}{search_info} | **Showing** {offset + 1} - {min(offset + limit, total_records)} of {total_records}\n\n"
 
-        except Exception as e:
-            return f"Failed to retrieve companies: {str(e)}"
+        return meta_info + paginated_df.to_markdown(index=False)
+
+    except Exception as e:
+        return f"Failed to retrieve companies: {str(e)}"
 
 
 @mcp.tool()
@@ -132,6 +280,15 @@ async def search_sahpra_products(company_name: str, limit: int = 15, offset: int
     :return: A markdown table of matching registered products, or a 'No products found' message.
     :rtype: str
     """
+    # The header echoes the caller's spelling, so only the table is shared
+    # across case variants of the same name.
+    cache_key = (company_name.lower(), limit, offset)
+    cached_result = _cache_get(_search_cache, cache_key)
+    if cached_result is not None:
+        total_records, table = cached_result
+        meta_info = f"**Search:** {company_name} | **Showing:** {offset + 1} - {min(offset + limit, total_records)} of {total_records}\n\n"
+        return meta_info + table
+
     API_URL = "https://medapps.sahpra.org.za:6006/Home/getData"
 
     headers = {
@@ -151,49 +308,41 @@ async def search_sahpra_products(company_name: str, limit: int = 15, offset: int
     }
 
     payload = {
-        "draw": "1",
+        **_STATIC_SEARCH_PAYLOAD,
         "start": str(offset),
         "length": str(limit),
-        "search[value]": company_name,
-        "search[regex]": "false",
-        "order[0][column]": "0",
-        "order[0][dir]": "asc"
+        "search[value]": company_name
     }
 
-    columns = ["applicantName", "productName", "api", "licence_no", "application_no", "reg_date", "status", "secureId"]
-    for i, column_name in enumerate(columns):
-        payload[f"columns[{i}][data]"] = column_name
-        payload[f"columns[{i}][name]"] = column_name if column_name != "secureId" else ""
-        payload[f"columns[{i}][searchable]"] = "true"
-        payload[f"columns[{i}][orderable]"] = "true"
-        payload[f"columns[{i}][search][value]"] = ""
-        payload[f"columns[{i}][search][regex]"] = "false"
+    client = await get_client()
 
-    async with httpx.AsyncClient(verify=False, timeout=30.0) as client:
-        try:
-            response = await client.post(API_URL, data=payload, headers=headers)
-            response.raise_for_status()
+    try:
+        response = await client.post(API_URL, data=payload, headers=headers)
+        response.raise_for_status()
 
-            data = response.json()
-            total_records = data.get("recordsFiltered", 0)
-            df = pandas.DataFrame(data["data"])
+        data = orjson.loads(response.content)
+        total_records = data.get("recordsFiltered", 0)
+        df = pandas.DataFrame(data["data"])
 
-            if df.empty:
-                return f"No products found for '{company_name}'"
-            
-            display_map = {
-                "applicantName": "Company",
-                "productName": "Product",
-                "licence_no": "Reg No.",
-                "reg_date": "Date"
-            }
+        if df.empty:
+            return f"No products found for '{company_name}'"
 
-            meta_info = f"**Search:** {company_name} | **Showing:** {offset + 1} - {min(offset + limit, total_records)} of {total_records}\n\n"
-            
-            return meta_info + df[list(display_map.keys())].rename(columns=display_map).to_markdown(index=False)
+        display_map = {
+            "applicantName": "Company",
+            "productName": "Product",
+            "licence_no": "Reg No.",
+            "reg_date": "Date"
+        }
 
-        except Exception as e:
-            return f"Search failed: {str(e)}"
+        meta_info = f"**Search:** {company_name} | **Showing:** {offset + 1} - {min(offset + limit, total_records)} of {total_records}\n\n"
+
+        table = df[list(display_map.keys())].rename(columns=display_map).to_markdown(index=False)
+        _cache_put(_search_cache, cache_key, (total_records, table))
+
+        return meta_info + table
+
+    except Exception as e:
+        return f"Search failed: {str(e)}"
 
 
 @mcp.tool()
@@ -238,14 +387,13 @@ async def analyse_ndoh_market(
 
     if query:
         if filter_type == "inn":
-            df = df[df["INN"].str.contains(query, case=False, na=False)]
+            df = df[df["INN"].str.contains(query, case=False, regex=False, na=False)]
         elif filter_type == "supplier":
-            df = df[df["Supplier"].str.contains(query, case=False, na=False)]
+            df = df[df["Supplier"].str.contains(query, case=False, regex=False, na=False)]
         elif filter_type == "atc":
             df = df[df["ATC_Code"].str.startswith(query.upper(), na=False)]
         else:
-            mask = df.apply(lambda x: x.astype(str).str.contains(query, case=False).any(), axis=1)
-            df = df[mask]
+            df = df[_match_any_column(df, query)]
 
     if df.empty:
         return f"No procurement data found for `{query}` with filter `{filter_type}`."
@@ -330,14 +478,13 @@ async def analyse_private_market(
 
     if query:
         if filter_type == "active_ingredient":
-            df = df[df["Active_Ingredient"].str.contains(query, case=False, na=False)]
+            df = df[df["Active_Ingredient"].str.contains(query, case=False, regex=False, na=False)]
         elif filter_type == "applicant":
-            df = df[df["Applicant"].str.contains(query, case=False, na=False)]
+            df = df[df["Applicant"].str.contains(query, case=False, regex=False, na=False)]
         elif filter_type == "nappi":
             df = df[df["NAPPI_Code"].str.startswith(query.upper(), na=False)]
         else:
-            mask = df.apply(lambda x: x.astype(str).str.contains(query, case=False).any(), axis=1)
-            df = df[mask]
+            df = df[_match_any_column(df, query)]
     
     if df.empty:
         return f"No private sector data found for `{query}` with filter `{filter_type}`."
@@ -472,13 +619,28 @@ def cross_market_viability_check(molecule: str) -> str:
 
 
 if __name__ == "__main__":
-    port = os.getenv("PORT")
+    async def run_server():
+        """
+        Runs the server on a single event loop, warming the data caches from
+        boot, and closes the shared HTTP client once it stops, after any
+        unfinished cache prefetch.
+        """
+        port = os.getenv("PORT")
+        _start_prefetch()
 
-    if port:
-        mcp.run(
-            transport="streamable-http",
-            host="0.0.0.0",
-            port=int(port),
-        )
-    else:
-        mcp.run()
+        try:
+            if port:
+                mcp.settings.host = "0.0.0.0"
+                mcp.settings.port = int(port)
+                await mcp.run_streamable_http_async()
+            else:
+                await mcp.run_stdio_async()
+
+        finally:
+            if _prefetch_task is not None:
+                _prefetch_task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await _prefetch_task
+            await close_client()
+
+    asyncio.run(run_server())